@@ -18,26 +18,46 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
 import dataclasses
-import datetime
 import enum
+import functools
 import os
 import pathlib
 import re
 import sys
-import tempfile
-from typing import Final, Literal, NoReturn
+from typing import TYPE_CHECKING, Any, Final, Literal, NoReturn
 
-import pygit2
-import tomlkit
-import tomlkit.container
-import tomlkit.items
+# Heavier modules are imported where used, so that --version starts quickly
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    import pygit2
 
 # TODO: Move most of this to __main__.py or wherever is appropriate
 
 PROJECT: Final[str] = "asf-example"
 # This is automatically updated
 VERSION: Final[str] = "0.0.1-dev33"
+# Set ASF_EXAMPLE_TRACE=1 to print trace messages to stderr
+TRACE: Final[bool] = os.environ.get("ASF_EXAMPLE_TRACE") == "1"
+
+# Matches the VERSION line in this file, see update_init_version
+# TODO: This pattern is very fragile, needs improvement
+INIT_VERSION_LINE: Final[re.Pattern[str]] = re.compile(
+    r'(?m)^VERSION:[ \t]*Final\[str\][ \t]*=[ \t]*"[^"\r\n]*"[ \t]*(?=\r?$)'
+)
+
+# Used to read and rewrite simple string values in pyproject.toml without parsing it
+PYPROJECT_EXCLUDE_NEWER_LINE: Final[re.Pattern[str]] = re.compile(
+    r'(?m)^([ \t]*exclude-newer[ \t]*=[ \t]*)"([^"\\\n]*)"'
+)
+# The [project] version in the raw HEAD blob, without crossing into the next table
+PYPROJECT_HEAD_VERSION: Final[re.Pattern[bytes]] = re.compile(
+    rb'(?ms)^\[project\][ \t]*(?:#[^\n]*)?$(?:(?!^[ \t]*\[).)*?^[ \t]*version[ \t]*=[ \t]*"([^"\\\n]*)"'
+)
+PYPROJECT_VERSION_LINE: Final[re.Pattern[str]] = re.compile(r'(?m)^([ \t]*version[ \t]*=[ \t]*)"([^"\\\n]*)"')
+TOML_TABLE_HEADER: Final[re.Pattern[str]] = re.compile(r"(?m)^[ \t]*(\[\[?)([^\[\]\n]*)\]")
 
 
 class BumpMode(enum.Enum):
@@ -46,28 +66,52 @@ class BumpMode(enum.Enum):
     SPECIFIC = "specific"
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
+class CliArgs:
+    bump_dev: bool
+    bump_release: bool
+    bump_specific: str | None
+    version: bool
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
 class HeadVersion:
     major: int
     minor: int
     patch: int
     dev: int | None
+    _str: str = dataclasses.field(init=False, repr=False, compare=False)
 
-    def __str__(self) -> str:
+    def __post_init__(self) -> None:
+        # Instances are immutable, so the string form can be computed once
         if self.dev is None:
-            return f"{self.major}.{self.minor}.{self.patch}"
-        return f"{self.major}.{self.minor}.{self.patch}-dev{self.dev}"
+            text = f"{self.major}.{self.minor}.{self.patch}"
+        else:
+            text = f"{self.major}.{self.minor}.{self.patch}-dev{self.dev}"
+        object.__setattr__(self, "_str", text)
+
+    def __str__(self) -> str:
+        return self._str
 
 
 ZERO_VERSION_SENTINEL: Final[HeadVersion] = HeadVersion(major=0, minor=0, patch=0, dev=None)
 
+# Keyed by bump mode and whether the HEAD version is a dev version
+VERSION_BUMPERS: Final[dict[tuple[BumpMode, bool], Callable[[HeadVersion], HeadVersion]]] = {
+    (BumpMode.RELEASE, True): lambda head: dataclasses.replace(head, dev=None),
+    (BumpMode.RELEASE, False): lambda head: dataclasses.replace(head, patch=head.patch + 1),
+    # The dev component is never None here, but the type checker cannot know that
+    (BumpMode.DEV, True): lambda head: dataclasses.replace(head, dev=(head.dev or 0) + 1),
+    (BumpMode.DEV, False): lambda head: dataclasses.replace(head, patch=head.patch + 1, dev=1),
+}
+
 
 def bump_mode_from_args(
-    args: argparse.Namespace,
+    args: CliArgs,
 ) -> (
     tuple[Literal[BumpMode.RELEASE], None] | tuple[Literal[BumpMode.DEV], None] | tuple[Literal[BumpMode.SPECIFIC], str]
 ):
-    trace(f"args: {args}")
+    trace("args: %s", args)
     if args.bump_release:
         return BumpMode.RELEASE, None
     elif args.bump_dev:
@@ -88,7 +132,9 @@ def cli_argument_parser() -> argparse.ArgumentParser:
 
 
 def current_repository(current_path: pathlib.Path) -> pygit2.Repository:
-    trace(f"current_path: {current_path}")
+    import pygit2
+
+    trace("current_path: %s", current_path)
     repository_directory = pygit2.discover_repository(str(current_path))
     if repository_directory is None:
         report_error_and_exit("not inside a git repository")
@@ -98,80 +144,73 @@ def current_repository(current_path: pathlib.Path) -> pygit2.Repository:
 def calculate_bumped_version(
     repository: pygit2.Repository, mode: BumpMode, specific: str | None
 ) -> tuple[HeadVersion, str]:
-    trace(f"calculate bumped version from mode: {mode}, specific: {specific}")
-    match mode:
-        case BumpMode.SPECIFIC:
-            if specific is None:
-                report_error_and_exit("specific version required")
-            return ZERO_VERSION_SENTINEL, specific
-        case BumpMode.RELEASE:
-            head_version = read_head_version(repository)
-            if head_version.dev is not None:
-                bumped = HeadVersion(
-                    head_version.major,
-                    head_version.minor,
-                    head_version.patch,
-                    None,
-                )
-                return head_version, str(bumped)
-            bumped = HeadVersion(
-                head_version.major,
-                head_version.minor,
-                head_version.patch + 1,
-                None,
-            )
-            return head_version, str(bumped)
-        case BumpMode.DEV:
-            head_version = read_head_version(repository)
-            if head_version.dev is None:
-                bumped = HeadVersion(
-                    head_version.major,
-                    head_version.minor,
-                    head_version.patch + 1,
-                    1,
-                )
-                return head_version, str(bumped)
-            bumped = HeadVersion(
-                head_version.major,
-                head_version.minor,
-                head_version.patch,
-                head_version.dev + 1,
-            )
-            return head_version, str(bumped)
+    trace("calculate bumped version from mode: %s, specific: %s", mode, specific)
+    if mode is BumpMode.SPECIFIC:
+        if specific is None:
+            report_error_and_exit("specific version required")
+        return ZERO_VERSION_SENTINEL, specific
+    head_version = read_head_version(repository)
+    bumped = VERSION_BUMPERS[(mode, head_version.dev is not None)](head_version)
+    return head_version, str(bumped)
 
 
 def main() -> NoReturn:
     raise SystemExit(run_cli())
 
 
+@functools.lru_cache(maxsize=128)
 def parse_version(version: str) -> HeadVersion:
-    trace(f"parsing version to HeadVersion: {version}")
-    match = re.fullmatch(r"(\d+)\.(\d+)\.(\d+)(?:-dev(\d+))?", version)
-    if not match:
+    trace("parsing version to HeadVersion: %s", version)
+    # Versions are MAJOR.MINOR.PATCH with an optional -devN suffix
+    base, separator, dev_part = version.partition("-dev")
+    parts = base.split(".")
+    if separator:
+        parts.append(dev_part)
+    # Only accept ASCII digits, as int also accepts signs, underscores, and other digits
+    if (len(parts) != (4 if separator else 3)) or not all(part.isascii() and part.isdigit() for part in parts):
         report_error_and_exit(f"unsupported version format: {version}")
-    major = int(match.group(1))
-    minor = int(match.group(2))
-    patch = int(match.group(3))
-    dev = int(match.group(4)) if match.group(4) is not None else None
+    major, minor, patch = int(parts[0]), int(parts[1]), int(parts[2])
+    dev = int(dev_part) if separator else None
     return HeadVersion(major=major, minor=minor, patch=patch, dev=dev)
 
 
 def project_root_or_exit(project_root: pathlib.Path, project_name: str) -> None:
-    trace(f"check project root: {project_root}, project_name: {project_name}")
+    import tomllib
+
+    trace("check project root: %s, project_name: %s", project_root, project_name)
     pyproject_path = project_root / "pyproject.toml"
     if not pyproject_path.is_file():
         report_error_and_exit(
             f"must run from project root with pyproject.toml for {project_name}",
         )
-    with pyproject_path.open("r", encoding="utf-8") as f:
-        data = tomlkit.load(f)
+    with pyproject_path.open("rb") as f:
+        data = tomllib.load(f)
     name = data.get("project", {}).get("name")
     if name != project_name:
         report_error_and_exit(f"pyproject.toml does not belong to '{project_name}'")
 
 
+def project_version(content: bytes) -> object:
+    import tomllib
+
+    # Usually the version is a plain string, and can be read without decoding or parsing the whole file
+    match = PYPROJECT_HEAD_VERSION.search(content)
+    # Any multi-line string up to the key, including one around the [project] header itself,
+    # may contain the matched lines, which only a full parse can handle
+    if (
+        (match is not None)
+        and (content.find(b'"""', 0, match.end()) == -1)
+        and (content.find(b"'''", 0, match.end()) == -1)
+    ):
+        return match.group(1).decode("utf-8")
+    # Only reading, so use tomllib rather than the style preserving tomlkit
+    return toml_value(tomllib.loads(content.decode("utf-8")), "project", "version")
+
+
 def read_head_version(repo: pygit2.Repository) -> HeadVersion:
-    trace(f"read head version from repository: {repo}")
+    import pygit2
+
+    trace("read head version from repository: %s", repo)
     if repo.is_bare:
         report_error_and_exit("a working tree, not a bare git repository, is required")
     try:
@@ -181,33 +220,72 @@ def read_head_version(repo: pygit2.Repository) -> HeadVersion:
         return ZERO_VERSION_SENTINEL
     if not isinstance(obj, pygit2.Blob):
         report_error_and_exit("pyproject.toml is in HEAD, but not a regular file")
-    content = obj.data.decode("utf-8")
-    data = tomlkit.parse(content)
-    head_version = data.get("project", {}).get("version")
-    # TODO: Not tomlkit.items.String?
+    head_version = project_version(obj.data)
     if not isinstance(head_version, str):
         report_error_and_exit("version missing in pyproject.toml in HEAD")
     return parse_version(head_version)
 
 
-def replace_key_in_section(text: str, section: str, key: str, value: str) -> str:
-    trace(f"replace key in section: section: {section}, key: {key}, value: {value}")
-    # TODO: This is very messy and probably wrong, needs improvement
+def replace_init_version(text: str, bumped_version: str) -> str | None:
+    # Only do this once
+    content, count = INIT_VERSION_LINE.subn(lambda _: f'VERSION: Final[str] = "{bumped_version}"', text, count=1)
+    if count == 0:
+        return None
+    return content
+
+
+def replace_keys_in_sections(text: str, updates: list[tuple[str, str, str]]) -> str:
+    import tomlkit
+
+    trace("replace keys in sections: updates: %s", updates)
     doc = tomlkit.parse(text)
-    current: tomlkit.container.Container = doc
-    for part in section.split("."):
-        item = current.get(part)
-        if not isinstance(item, tomlkit.items.Table):
-            current[part] = tomlkit.table()
-            item = current[part]
-        if not isinstance(item, tomlkit.items.Table):
-            # Should be impossible
-            report_error_and_exit(f"expected table, got {type(item)}")
-        current = item.value
-    current[key] = value
+    for section, key, value in updates:
+        table: dict[str, object] = doc
+        for part in section.split("."):
+            item = table.get(part)
+            # Tables, including tables split across the document, are all dict subclasses in tomlkit
+            if not isinstance(item, dict):
+                # Tables added to the document stay live, so keep a reference to the new one
+                item = tomlkit.table()
+                table[part] = item
+            table = item
+        table[key] = value
     return tomlkit.dumps(doc)
 
 
+def replace_pyproject_version(text: str, data: dict[str, Any], bumped_version: str, now: str) -> str:
+    import tomllib
+
+    # The data argument is text as already parsed by tomllib, and is not modified
+    trace("replace pyproject version: bumped_version: %s, now: %s", bumped_version, now)
+    updates = [("project", "version", bumped_version), ("tool.uv", "exclude-newer", now)]
+    # Rewrite existing keys in place, and only parse the TOML with tomlkit if that fails
+    content = replace_string_in_section(text, "project", PYPROJECT_VERSION_LINE, bumped_version)
+    if content is not None:
+        content = replace_string_in_section(content, "tool.uv", PYPROJECT_EXCLUDE_NEWER_LINE, now)
+    if content is not None:
+        # The line patterns do not understand TOML syntax such as multi-line strings, so check that
+        # the result is the original document with exactly the two updates applied
+        if tomllib.loads(content) == toml_with_values(data, updates):
+            return content
+    return replace_keys_in_sections(text, updates)
+
+
+def replace_string_in_section(text: str, section: str, key_line: re.Pattern[str], value: str) -> str | None:
+    trace("replace string in section: section: %s, pattern: %s, value: %s", section, key_line.pattern, value)
+    # Only values which need no escaping can be written as plain basic strings
+    if ('"' in value) or ("\\" in value) or (not value.isprintable()):
+        return None
+    span = section_span(text, section)
+    if span is None:
+        return None
+    start, end = span
+    body, count = key_line.subn(lambda m: f'{m.group(1)}"{value}"', text[start:end], count=1)
+    if count == 0:
+        return None
+    return text[:start] + body + text[end:]
+
+
 def report_error_and_exit(message: str) -> NoReturn:
     print(f"error: {message}", file=sys.stderr)
     raise SystemExit(2)
@@ -215,11 +293,12 @@ def report_error_and_exit(message: str) -> NoReturn:
 
 def run_cli() -> int:
     parser = cli_argument_parser()
-    args = parser.parse_args()
+    # Convert to typed arguments once, at the command line boundary
+    args = CliArgs(**vars(parser.parse_args()))
     return run_using_args(args)
 
 
-def run_using_args(args: argparse.Namespace) -> int:
+def run_using_args(args: CliArgs) -> int:
     # Report the current version if --version is present
     if args.version:
         print(VERSION)
@@ -229,6 +308,11 @@ def run_using_args(args: argparse.Namespace) -> int:
     current_path = pathlib.Path.cwd()
     project_root_or_exit(current_path, PROJECT)
 
+    # Each run reads a single blob once, so the process wide libgit2 object cache is never hit
+    import pygit2
+
+    pygit2.settings.enable_caching(False)
+
     # Get the pygit2 repository, bump mode, and optional specific version
     repository = current_repository(current_path)
     mode, specific = bump_mode_from_args(args)
@@ -246,59 +330,117 @@ def run_using_args(args: argparse.Namespace) -> int:
     return 0
 
 
-def trace(message: str) -> None:
-    print(f"trace: {message}", file=sys.stderr)
+def section_span(text: str, section: str) -> tuple[int, int] | None:
+    # The body of a table runs from the end of its header to the start of the next header
+    start: int | None = None
+    for header in TOML_TABLE_HEADER.finditer(text):
+        if start is not None:
+            return start, header.start()
+        name = ".".join(part.strip() for part in header.group(2).split("."))
+        if (header.group(1) == "[") and (name == section):
+            start = header.end()
+    if start is None:
+        return None
+    return start, len(text)
+
+
+def toml_value(data: dict[str, object], section: str, key: str) -> object:
+    current: object = data
+    for part in (*section.split("."), key):
+        if not isinstance(current, dict):
+            return None
+        current = current.get(part)
+    return current
+
+
+def toml_with_values(data: dict[str, Any], updates: list[tuple[str, str, str]]) -> dict[str, Any] | None:
+    import copy
+
+    result = copy.deepcopy(data)
+    for section, key, value in updates:
+        table: object = result
+        for part in section.split("."):
+            if not isinstance(table, dict):
+                return None
+            table = table.setdefault(part, {})
+        if not isinstance(table, dict):
+            return None
+        table[key] = value
+    return result
+
+
+def trace(message: str, *args: object) -> None:
+    # Formatting is deferred so that it costs nothing when tracing is disabled
+    if not TRACE:
+        return
+    print(f"trace: {message % args}", file=sys.stderr)
 
 
 def update_init_version(bumped_version: str) -> None:
-    trace(f"update init version with bumped version: {bumped_version}")
+    trace("update init version with bumped version: %s", bumped_version)
     init_path = pathlib.Path(__file__)
-    # TODO: This pattern is very fragile, needs improvement
-    version_pattern = r'VERSION:\s*Final\[str\]\s*=\s*".*?"\s*\n?'
-    tmp_fd, tmp_name = tempfile.mkstemp(prefix="__init__.", suffix=".tmp", dir=str(init_path.parent))
     try:
-        with (
-            os.fdopen(tmp_fd, "w", encoding="utf-8", newline="") as tmp,
-            init_path.open("r", encoding="utf-8", newline="") as src,
-        ):
-            # Only do this once
-            replaced = False
-            for line in src:
-                contains_version = re.fullmatch(version_pattern, line)
-                if (not replaced) and contains_version:
-                    tmp.write(f'VERSION: Final[str] = "{bumped_version}"\n')
-                    replaced = True
-                else:
-                    tmp.write(line)
-        os.replace(tmp_name, init_path)
+        content = replace_init_version(init_path.read_text(encoding="utf-8", newline=""), bumped_version)
+    except Exception:
+        report_error_and_exit("failed to update VERSION constant in __init__.py")
+    if content is None:
+        report_error_and_exit("VERSION constant not found in __init__.py")
+    tmp_path = init_path.with_name(init_path.name + ".tmp")
+    # Truncate any file left by an interrupted run, and only unlink once this run has opened it
+    try:
+        tmp = tmp_path.open("w", encoding="utf-8", newline="")
+    except Exception:
+        report_error_and_exit("failed to update VERSION constant in __init__.py")
+    try:
+        with tmp:
+            tmp.write(content)
+        os.replace(tmp_path, init_path)
     except Exception:
-        try:
-            os.remove(tmp_name)
-        except Exception:
-            pass
+        with contextlib.suppress(OSError):
+            tmp_path.unlink(missing_ok=True)
         report_error_and_exit("failed to update VERSION constant in __init__.py")
 
 
 def update_pyproject_version(bumped_version: str) -> None:
-    trace(f"update pyproject version with bumped version: {bumped_version}")
+    import datetime
+    import tomllib
+
+    trace("update pyproject version with bumped version: %s", bumped_version)
     pyproject_path = pathlib.Path("pyproject.toml")
-    tmp_fd, tmp_name = tempfile.mkstemp(prefix="pyproject.", suffix=".tmp", dir=str(pyproject_path.parent))
+    # Equivalent to strftime("%Y-%m-%dT%H:%M:%SZ") for UTC times
+    now = datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds").replace("+00:00", "Z")
     try:
-        with (
-            os.fdopen(tmp_fd, "w", encoding="utf-8", newline="") as tmp,
-            pyproject_path.open("r", encoding="utf-8", newline="") as src,
+        content = pyproject_path.read_text(encoding="utf-8", newline="")
+        # Skip the write if the version is unchanged and exclude-newer is already from today
+        data = tomllib.loads(content)
+        current_exclude_newer = toml_value(data, "tool.uv", "exclude-newer")
+        if (
+            (toml_value(data, "project", "version") == bumped_version)
+            and isinstance(current_exclude_newer, str)
+            and (current_exclude_newer[:10] == now[:10])
         ):
-            content = src.read()
-            now = datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
-            content = replace_key_in_section(content, "project", "version", bumped_version)
-            content = replace_key_in_section(content, "tool.uv", "exclude-newer", now)
+            trace("pyproject.toml is already up to date")
+            return
+        content = replace_pyproject_version(content, data, bumped_version, now)
+    except Exception as exc:
+        report_error_and_exit(
+            f"failed to update pyproject.toml: {exc}; project may be in an inconsistent version state"
+        )
+    tmp_path = pyproject_path.with_name(pyproject_path.name + ".tmp")
+    # Truncate any file left by an interrupted run, and only unlink once this run has opened it
+    try:
+        tmp = tmp_path.open("w", encoding="utf-8", newline="")
+    except Exception as exc:
+        report_error_and_exit(
+            f"failed to update pyproject.toml: {exc}; project may be in an inconsistent version state"
+        )
+    try:
+        with tmp:
             tmp.write(content)
-        os.replace(tmp_name, pyproject_path)
+        os.replace(tmp_path, pyproject_path)
     except Exception as exc:
-        try:
-            os.remove(tmp_name)
-        except Exception:
-            pass
+        with contextlib.suppress(OSError):
+            tmp_path.unlink(missing_ok=True)
         report_error_and_exit(
             f"failed to update pyproject.toml: {exc}; project may be in an inconsistent version state"
         )
@@ -0,0 +1,161 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import annotations
+
+import datetime
+import tomllib
+from typing import TYPE_CHECKING
+
+import asf.example as example
+
+if TYPE_CHECKING:
+    import pathlib
+
+    import pytest
+
+NOW = "2026-01-02T03:04:05Z"
+
+PYPROJECT = """\
+[project]
+name            = "asf-example"
+# This is automatically updated
+version         = "0.0.1-dev1"
+description     = "Example"
+
+[project.scripts]
+asf-example = "asf.example:main"
+
+[tool.uv]
+# This is automatically updated
+exclude-newer = "2025-11-20T10:57:11Z"
+"""
+
+
+class FixedDateTime(datetime.datetime):
+    @classmethod
+    def now(cls, tz: datetime.tzinfo | None = None) -> FixedDateTime:
+        return cls(2026, 1, 2, 3, 4, 5, tzinfo=tz)
+
+
+UPDATED_PYPROJECT = PYPROJECT.replace('"0.0.1-dev1"', '"0.0.2"').replace('"2025-11-20T10:57:11Z"', f'"{NOW}"')
+
+
+def test_missing_key_or_table() -> None:
+    assert example.replace_string_in_section(PYPROJECT, "tool.uv", example.PYPROJECT_VERSION_LINE, "0.0.2") is None
+    assert example.replace_string_in_section(PYPROJECT, "tool.hatch", example.PYPROJECT_VERSION_LINE, "0.0.2") is None
+    text = '[project]\nname = "asf-example"\n'
+    data = tomllib.loads(example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW))
+    assert data["project"] == {"name": "asf-example", "version": "0.0.2"}
+    assert data["tool"]["uv"]["exclude-newer"] == NOW
+
+
+def test_array_of_tables_header_ends_section() -> None:
+    text = '[project]\nname = "asf-example"\n\n[[project.authors]]\nname = "ASF"\nversion = "9.9.9"\n'
+    assert example.replace_string_in_section(text, "project", example.PYPROJECT_VERSION_LINE, "0.0.2") is None
+    data = tomllib.loads(example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW))
+    assert data["project"]["version"] == "0.0.2"
+    assert data["project"]["authors"] == [{"name": "ASF", "version": "9.9.9"}]
+
+
+def test_crlf_line_endings() -> None:
+    text = PYPROJECT.replace("\n", "\r\n")
+    result = example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW)
+    assert result == UPDATED_PYPROJECT.replace("\n", "\r\n")
+
+
+def test_multi_line_string() -> None:
+    # The key line pattern also matches inside the string, which comes before the real key
+    text = PYPROJECT.replace('description     = "Example"\n', "").replace(
+        "# This is automatically updated\nversion", 'description = """\nversion = "6.6.6"\n"""\nversion', 1
+    )
+    data = tomllib.loads(example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW))
+    assert data["project"]["version"] == "0.0.2"
+    assert data["project"]["description"] == 'version = "6.6.6"\n'
+    assert data["tool"]["uv"]["exclude-newer"] == NOW
+
+
+def test_project_version() -> None:
+    assert example.project_version(PYPROJECT.encode("utf-8")) == "0.0.1-dev1"
+    # An escaped value is not matched by the pattern, so tomllib decodes it
+    assert example.project_version(b'[project]\nversion = "1.2.3\\u002d"\n') == "1.2.3-"
+    assert example.project_version(b'[project]\nname = "asf-example"\n') is None
+    for quotes in (b'"""', b"'''"):
+        text = b"[project]\ndescription = " + quotes + b'\nversion = "6.6.6"\n' + quotes + b'\nversion = "1.2.3"\n'
+        assert example.project_version(text) == "1.2.3"
+        # A [project] header inside a multi-line string in an earlier table
+        text = (
+            b"[tool.x]\nnote = "
+            + quotes
+            + b'\n[project]\nversion = "9.9.9"\n'
+            + quotes
+            + b'\n\n[project]\nversion = "1.0.0"\n'
+        )
+        assert example.project_version(text) == "1.0.0"
+
+
+def test_multi_line_string_with_unchanged_version() -> None:
+    # Both target keys end up correct, but the in-place rewrite would also change the string
+    text = UPDATED_PYPROJECT.replace('description     = "Example"\n', "").replace(
+        "# This is automatically updated\nversion", 'description = """\nversion = "0.0.1"\n"""\nversion', 1
+    )
+    data = tomllib.loads(example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW))
+    assert data["project"]["version"] == "0.0.2"
+    assert data["project"]["description"] == 'version = "0.0.1"\n'
+    assert data["tool"]["uv"]["exclude-newer"] == NOW
+
+
+def test_nested_array_line_starting_with_bracket() -> None:
+    text = PYPROJECT.replace("# This is automatically updated\nversion", "matrix = [\n[1, 2],\n]\nversion", 1)
+    data = tomllib.loads(example.replace_pyproject_version(text, tomllib.loads(text), "0.0.2", NOW))
+    assert data["project"]["version"] == "0.0.2"
+    assert data["project"]["matrix"] == [[1, 2]]
+
+
+def test_normal_file() -> None:
+    assert example.replace_pyproject_version(PYPROJECT, tomllib.loads(PYPROJECT), "0.0.2", NOW) == UPDATED_PYPROJECT
+
+
+def test_split_tool_tables_are_kept() -> None:
+    # tomlkit returns a proxy rather than a table for [tool] when its subtables are not contiguous
+    text = '[tool.ruff]\nline-length = 120\n\n[project]\nname = "asf-example"\n\n[tool.uv]\nindex-url = "x"\n'
+    data = tomllib.loads(example.replace_keys_in_sections(text, [("tool.uv", "exclude-newer", NOW)]))
+    assert data["tool"] == {"ruff": {"line-length": 120}, "uv": {"index-url": "x", "exclude-newer": NOW}}
+    assert data["project"] == {"name": "asf-example"}
+
+
+def test_update_skips_write_only_when_current(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    # Fix the clock, so that the test does not depend on the UTC date staying the same
+    monkeypatch.setattr(datetime, "datetime", FixedDateTime)
+    pyproject_path = tmp_path / "pyproject.toml"
+
+    # Unchanged version and same day exclude-newer, so the file is left as it is
+    current = UPDATED_PYPROJECT.replace(NOW, "2026-01-02T00:00:00Z")
+    pyproject_path.write_text(current, encoding="utf-8")
+    example.update_pyproject_version("0.0.2")
+    assert pyproject_path.read_text(encoding="utf-8") == current
+
+    # Only a multi-line string holds the bumped version, so the real key must still be updated
+    trap = current.replace('description     = "Example"\n', "").replace(
+        "# This is automatically updated\nversion", 'description = """\nversion = "0.0.3"\n"""\nversion', 1
+    )
+    pyproject_path.write_text(trap, encoding="utf-8")
+    example.update_pyproject_version("0.0.3")
+    data = tomllib.loads(pyproject_path.read_text(encoding="utf-8"))
+    assert data["project"]["version"] == "0.0.3"
+    assert data["tool"]["uv"]["exclude-newer"] == NOW
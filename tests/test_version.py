@@ -0,0 +1,83 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+import asf.example as example
+
+if TYPE_CHECKING:
+    import pathlib
+
+
+def test_parse_version() -> None:
+    assert example.parse_version("0.0.1") == example.HeadVersion(major=0, minor=0, patch=1, dev=None)
+    assert example.parse_version("1.22.333-dev4") == example.HeadVersion(major=1, minor=22, patch=333, dev=4)
+    for version in ("0.0.1", "0.0.1-dev1", "1.22.333-dev4"):
+        assert str(example.parse_version(version)) == version
+
+
+def test_parse_version_rejects_unsupported_formats() -> None:
+    # \uff11 is FULLWIDTH DIGIT ONE, which int accepts but versions must not contain
+    for version in ("1.2.3-dev", "1.2", "1.2.3.4", "+1.2.3", "1_0.2.3", "\uff11.2.3", "1.2.3-dev5-dev6"):
+        with pytest.raises(SystemExit):
+            example.parse_version(version)
+
+
+def test_version_bumpers() -> None:
+    # Same results as the match statement which VERSION_BUMPERS replaced
+    expected = {
+        ("1.2.3", example.BumpMode.RELEASE): "1.2.4",
+        ("1.2.3-dev4", example.BumpMode.RELEASE): "1.2.3",
+        ("1.2.3", example.BumpMode.DEV): "1.2.4-dev1",
+        ("1.2.3-dev4", example.BumpMode.DEV): "1.2.3-dev5",
+    }
+    for (version, mode), bumped in expected.items():
+        head_version = example.parse_version(version)
+        bumper = example.VERSION_BUMPERS[(mode, head_version.dev is not None)]
+        assert str(bumper(head_version)) == bumped
+    assert len(example.VERSION_BUMPERS) == len(expected)
+
+
+def test_replace_init_version() -> None:
+    text = '"""Example."""\n\nPROJECT: Final[str] = "asf-example"\nVERSION: Final[str] = "0.0.1-dev1"\n\n\nX = 1\n'
+    expected = text.replace("0.0.1-dev1", "0.0.2")
+    assert example.replace_init_version(text, "0.0.2") == expected
+    crlf_text = text.replace("\n", "\r\n")
+    assert example.replace_init_version(crlf_text, "0.0.2") == expected.replace("\n", "\r\n")
+    assert example.replace_init_version('PROJECT_VERSION: Final[str] = "0.0.1"\n', "0.0.2") is None
+
+
+def test_update_init_version(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    init_path = tmp_path / "__init__.py"
+    monkeypatch.setattr(example, "__file__", str(init_path))
+
+    # A file left by an interrupted run is overwritten, and does not remain afterwards
+    init_path.write_text('VERSION: Final[str] = "0.0.1"\n', encoding="utf-8")
+    (tmp_path / "__init__.py.tmp").write_text("stale\n", encoding="utf-8")
+    example.update_init_version("0.0.2")
+    assert init_path.read_text(encoding="utf-8") == 'VERSION: Final[str] = "0.0.2"\n'
+    assert not (tmp_path / "__init__.py.tmp").exists()
+
+    init_path.write_text('PROJECT: Final[str] = "asf-example"\n', encoding="utf-8")
+    with pytest.raises(SystemExit):
+        example.update_init_version("0.0.2")
+    assert init_path.read_text(encoding="utf-8") == 'PROJECT: Final[str] = "asf-example"\n'